@@ -1,18 +1,32 @@
-from bilibili_utils import av2bv
+from bilibili_utils import av2bv_array
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
+import shutil
+import subprocess
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
+import threading
 from tqdm import tqdm
 import time
 
+# Read/write buffer for streaming media downloads (1 MiB)
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Retries for API calls answered with 429; the back-off is shared by all workers
+API_RETRIES = 3
+API_BACKOFF = 0.5
+
 
 class BilibiliDownloader:
-    def __init__(self, base_path, max_workers=8):
+    def __init__(self, base_path, max_workers=8, api_interval=0.05):
         """
-        Initialize the downloader with base path and number of worker threads
+        Initialize the downloader with base path and number of worker threads.
+        api_interval is the minimum spacing in seconds between Bilibili API calls
+        across all worker threads.
         """
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -21,6 +35,81 @@ class BilibiliDownloader:
         self.base_path = base_path
         self.max_workers = max_workers
         self.download_records = []
+        
+        # Shared session so API and CDN requests reuse keep-alive connections
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=self.max_workers,
+            pool_maxsize=self.max_workers * 4,
+            max_retries=Retry(
+                total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                # Hand the last response back once retries run out so the status checks below still apply
+                raise_on_status=False
+            )
+        )
+        self.session.mount('https://', adapter)
+        # API calls retry 5xx in the adapter, but 429s are handled in _api_get so the
+        # back-off pauses every worker instead of only the throttled one
+        api_adapter = HTTPAdapter(
+            pool_connections=self.max_workers,
+            pool_maxsize=self.max_workers * 4,
+            max_retries=Retry(
+                total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                raise_on_status=False, respect_retry_after_header=False
+            )
+        )
+        self.session.mount('https://api.bilibili.com/', api_adapter)
+        
+        # Shared pacing for api.bilibili.com calls
+        self.api_interval = api_interval
+        self._api_lock = threading.Lock()
+        self._next_api_time = time.monotonic()
+        self._api_paused_until = self._next_api_time
+        
+        # Shared pool for the per-video media/subtitle fetches, reused across all videos
+        self._io_pool = ThreadPoolExecutor(max_workers=2 * self.max_workers, thread_name_prefix='dl')
+    
+    def _wait_api_slot(self):
+        """Block until this thread may send the next API call"""
+        while True:
+            with self._api_lock:
+                now = time.monotonic()
+                slot = max(now, self._next_api_time)
+                self._next_api_time = slot + self.api_interval
+            if slot > now:
+                time.sleep(slot - now)
+            # A back-off imposed while we slept also applies to slots reserved before it
+            with self._api_lock:
+                if time.monotonic() >= self._api_paused_until:
+                    return
+    
+    def _delay_api(self, delay):
+        """Pause all API calls for at least delay seconds"""
+        with self._api_lock:
+            resume = time.monotonic() + delay
+            self._api_paused_until = max(self._api_paused_until, resume)
+            self._next_api_time = max(self._next_api_time, resume)
+    
+    @staticmethod
+    def _retry_delay(response, attempt):
+        """Seconds to wait after a 429: Retry-After if given in seconds, else exponential back-off"""
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return float(retry_after)
+        return API_BACKOFF * (2 ** attempt)
+    
+    def _api_get(self, url):
+        """Issue an API request, keeping at least api_interval between calls.
+        
+        A 429 delays the shared schedule, so all workers back off together.
+        """
+        for attempt in range(API_RETRIES + 1):
+            self._wait_api_slot()
+            response = self.session.get(url, timeout=(5, 30))
+            if response.status_code != 429 or attempt == API_RETRIES:
+                return response
+            self._delay_api(self._retry_delay(response, attempt))
     
     def sanitize_filename(self, filename):
         """Remove illegal characters from filename"""
@@ -29,7 +118,7 @@ class BilibiliDownloader:
     def get_subtitle_urls(self, bvid, cid):
         """Get subtitle information for a video"""
         url = f'https://api.bilibili.com/x/player/v2?bvid={bvid}&cid={cid}'
-        response = requests.get(url, headers=self.headers)
+        response = self._api_get(url)
         subtitle_urls = []
         
         if response.status_code == 200:
@@ -46,7 +135,7 @@ class BilibiliDownloader:
     def download_subtitle(self, subtitle_url, output_path, language):
         """Download and convert subtitle to txt format"""
         try:
-            response = requests.get(subtitle_url, headers=self.headers)
+            response = self.session.get(subtitle_url, timeout=(5, 30))
             if response.status_code == 200:
                 subtitle_data = response.json()
                 
@@ -64,25 +153,24 @@ class BilibiliDownloader:
     def get_video_info(self, bvid):
         """Get video information"""
         url = f'https://api.bilibili.com/x/web-interface/view?bvid={bvid}'
-        response = requests.get(url, headers=self.headers)
+        response = self._api_get(url)
         return response.json()
     
     def get_play_url(self, bvid, cid):
         """Get video playback URL"""
         url = f'https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&qn=80&fnval=16'
-        response = requests.get(url, headers=self.headers)
+        response = self._api_get(url)
         return response.json()
     
     def download_file(self, url, filename):
         """Download file and return status"""
         try:
-            response = requests.get(url, headers=self.headers, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
-            
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            with self.session.get(url, stream=True, timeout=(5, 60)) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                
+                with open(filename, 'wb') as f:
+                    shutil.copyfileobj(response.raw, f, length=DOWNLOAD_BUFFER_SIZE)
             return True
         except Exception as e:
             print(f"Download failed: {filename}, Error: {str(e)}")
@@ -90,9 +178,18 @@ class BilibiliDownloader:
     
     def merge_audio_video(self, video_file, audio_file, output_file):
         """Merge audio and video files"""
-        os.system(f'ffmpeg -i "{video_file}" -i "{audio_file}" -c copy "{output_file}"')
-        os.remove(video_file)
-        os.remove(audio_file)
+        subprocess.run(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+             '-i', video_file, '-i', audio_file,
+             '-c', 'copy', '-movflags', '+faststart', output_file],
+            check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, timeout=600
+        )
+        for path in (video_file, audio_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
     def download_single_video(self, bvid):
         """Download all content (video, audio, subtitles) for a single video"""
@@ -135,19 +232,23 @@ class BilibiliDownloader:
             video_url = dash['video'][0]['baseUrl']
             audio_url = dash['audio'][0]['baseUrl']
             
-            with ThreadPoolExecutor(max_workers=2) as executor:
-                video_future = executor.submit(self.download_file, video_url, video_file)
-                audio_future = executor.submit(self.download_file, audio_url, audio_file)
-                
+            video_future = self._io_pool.submit(self.download_file, video_url, video_file)
+            audio_future = self._io_pool.submit(self.download_file, audio_url, audio_file)
+            
+            # Fetch all subtitle tracks concurrently while the media downloads run.
+            # The media futures are always awaited so no write outlives the record
+            try:
+                subtitle_futures = [
+                    self._io_pool.submit(
+                        self.download_subtitle, subtitle_url,
+                        os.path.join(output_dir, f'{bvid}_{language}.txt'), language
+                    )
+                    for subtitle_url, language in self.get_subtitle_urls(bvid, cid)
+                ]
+            finally:
                 record['video_downloaded'] = video_future.result()
                 record['audio_downloaded'] = audio_future.result()
-            
-            subtitle_urls = self.get_subtitle_urls(bvid, cid)
-            if subtitle_urls:
-                for subtitle_url, language in subtitle_urls:
-                    subtitle_file = os.path.join(output_dir, f'{bvid}_{language}.txt')
-                    if self.download_subtitle(subtitle_url, subtitle_file, language):
-                        record['subtitle_count'] += 1
+            record['subtitle_count'] = sum(1 for future in as_completed(subtitle_futures) if future.result())
             
             if record['video_downloaded'] and record['audio_downloaded']:
                 record['status'] = 'success'
@@ -160,31 +261,56 @@ class BilibiliDownloader:
         
         return record
 
-    def batch_download(self, df):
-        """Parallel batch download videos"""
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+    def batch_download(self, df, on_complete=None):
+        """Parallel batch download videos
+        
+        on_complete, if given, is called with each finished download record on the
+        calling thread while the remaining downloads keep running in the pool.
+        """
+        # Completed records are appended one line at a time so progress survives
+        # an interrupted run; the CSV is only rebuilt once the batch finishes
+        os.makedirs(self.base_path, exist_ok=True)
+        records_path = os.path.join(self.base_path, 'download_records.jsonl')
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                open(records_path, 'a', encoding='utf-8', buffering=1) as records_file:
+            # Deduplicate up front (order preserved) so repeated bvids are fetched once
+            bvids = df['bvid'].unique()
             future_to_bvid = {
-                executor.submit(self.download_single_video, row['bvid']): row['bvid'] 
-                for _, row in df.iterrows()
+                executor.submit(self.download_single_video, bvid): bvid
+                for bvid in bvids
             }
             
-            with tqdm(total=len(df), desc="Download Progress") as pbar:
+            with tqdm(total=len(bvids), desc="Download Progress") as pbar:
                 for future in as_completed(future_to_bvid):
                     bvid = future_to_bvid[future]
+                    record = None
                     try:
                         record = future.result()
                         self.download_records.append(record)
-                        self.save_records()
+                        records_file.write(json.dumps(record, ensure_ascii=False) + '\n')
                     except Exception as e:
                         print(f"Error downloading {bvid}: {str(e)}")
                     finally:
                         pbar.update(1)
+                    if record is not None and on_complete is not None:
+                        # A failing callback must not drop the remaining records of the batch
+                        try:
+                            on_complete(record)
+                        except Exception as e:
+                            print(f"Error in on_complete for {bvid}: {str(e)}")
+        
+        self.save_records()
     
     def save_records(self):
         """Save download records to CSV"""
         records_df = pd.DataFrame(self.download_records)
         records_df.to_csv(os.path.join(self.base_path, 'download_records.csv'), index=False)
     
+    def close(self):
+        """Shut down the shared download pool and close pooled connections"""
+        self._io_pool.shutdown(wait=True)
+        self.session.close()
+    
     def get_statistics(self):
         """Get download statistics"""
         records_df = pd.DataFrame(self.download_records)
@@ -203,7 +329,7 @@ if __name__ == '__main__':
     video_store_path = '/Volumes/externalssd/bilibili/'
 
     data = pd.read_csv(data_path)
-    data['bvid'] = data['avid'].apply(av2bv)
+    data['bvid'] = av2bv_array(data['avid'].to_numpy())
     data.drop(columns=['avid', 'Unnamed: 0'], inplace=True)
     
     # Initialize downloader with 32 parallel download threads
@@ -212,6 +338,7 @@ if __name__ == '__main__':
     # Start batch download
     print("Starting video downloads...")
     downloader.batch_download(data)
+    downloader.close()
     
     # Get and print statistics
     stats = downloader.get_statistics()
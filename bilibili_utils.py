@@ -1,3 +1,5 @@
+import numpy as np
+
 XOR_CODE = 23442827791579
 MASK_CODE = 2251799813685247
 MAX_AID = 1 << 51
@@ -9,6 +11,10 @@ BASE = len(ALPHABET)
 PREFIX = "BV1"
 PREFIX_LEN = len(PREFIX)
 CODE_LEN = len(ENCODE_MAP)
+BVID_LEN = PREFIX_LEN + CODE_LEN
+
+_ALPHABET_BYTES = np.frombuffer(ALPHABET.encode(), dtype=np.uint8)
+_PREFIX_BYTES = np.frombuffer(PREFIX.encode(), dtype=np.uint8)
 
 def av2bv(aid: int) -> str:
     bvid = [""] * 9
@@ -18,6 +24,15 @@ def av2bv(aid: int) -> str:
         tmp //= BASE
     return PREFIX + "".join(bvid)
 
+def av2bv_array(aids) -> np.ndarray:
+    tmp = (MAX_AID | np.asarray(aids, dtype=np.int64).ravel()) ^ XOR_CODE
+    bvid = np.empty((len(tmp), BVID_LEN), dtype=np.uint8)
+    bvid[:, :PREFIX_LEN] = _PREFIX_BYTES
+    for i in range(CODE_LEN):
+        bvid[:, PREFIX_LEN + ENCODE_MAP[i]] = _ALPHABET_BYTES[tmp % BASE]
+        tmp //= BASE
+    return bvid.view(f"S{BVID_LEN}").ravel().astype(str)
+
 def bv2av(bvid: str) -> int:
     assert bvid[:3] == PREFIX
 
@@ -29,4 +44,4 @@ def bv2av(bvid: str) -> int:
     return (tmp & MASK_CODE) ^ XOR_CODE
 
 
-__all__ = ['av2bv','bv2av'] 
\ No newline at end of file
+__all__ = ['av2bv','av2bv_array','bv2av'] 
\ No newline at end of file
@@ -5,12 +5,13 @@ import os
 import glob
 import time
 import argparse
-import subprocess
 import multiprocessing
 from tqdm import tqdm
 import concurrent.futures
 import shutil
+import zipfile
 import re
+import fnmatch
 import pandas as pd
 
 # 配置选项
@@ -19,9 +20,9 @@ CONFIG = {
     'archive_format': 'zip',  # 压缩格式: zip, tar, gztar, bztar, xztar
     'compression_level': 9,   # 压缩级别 (1-9, 仅zip格式使用)
     'batch_size': 50,         # 每批处理的文件/目录数量
-    'timeout': 1800,          # 压缩命令超时时间(秒)
     'delete_original': False, # 压缩后是否删除原始文件/目录
     'skip_compressed': True,  # 跳过已压缩的文件/目录
+    'compute_ratio': True,    # 是否统计原目录大小以计算压缩率（需要遍历整个目录）
 }
 
 def compress_directory(dir_path, output_path=None, config=None):
@@ -45,46 +46,63 @@ def compress_directory(dir_path, output_path=None, config=None):
     if not os.path.exists(dir_path):
         return {'success': False, 'error': '输入目录不存在', 'input_path': dir_path}
     
-    # 获取目录大小
-    input_size = get_dir_size(dir_path) / (1024 * 1024)  # MB
-    
-    # 获取目录名称
+    # 获取父目录名称
     dir_name = os.path.dirname(dir_path)
-    base_name = os.path.basename(dir_path)
     
     # 设置输出路径
     if output_path is None:
         output_path = f"{dir_path}.{config['archive_format']}"
     
-    # 检查输出文件是否已存在
+    # 检查输出文件是否已存在（跳过时不统计目录大小，避免无谓的全目录遍历）
     if os.path.exists(output_path) and config['skip_compressed']:
         output_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
         return {
             'success': True, 
             'input_path': dir_path,
             'output_path': output_path,
-            'input_size': input_size,
             'output_size': output_size,
-            'compression_ratio': output_size / max(1, input_size),
             'time': 0,
             'skipped': True
         }
     
+    # 获取目录大小（仅在确实需要压缩且需要压缩率时计算），不计算时为None
+    input_size = get_dir_size(dir_path) / (1024 * 1024) if config['compute_ratio'] else None  # MB
+    
     try:
         print(f"正在压缩目录: {dir_path}")
         
-        # 设置压缩命令
+        # 设置压缩方式
         if config['archive_format'] == 'zip':
-            # 使用zip命令行工具，可以设置压缩级别
-            cmd = [
-                'zip', 
-                f'-{config["compression_level"]}',  # 压缩级别
-                '-r',  # 递归
-                output_path, 
-                base_name  # 只压缩目标目录
-            ]
-            # 切换到父目录执行命令
-            cwd = dir_name if dir_name else '.'
+            # 使用Python内置的zipfile，避免为每个目录启动zip子进程
+            parent_dir = dir_name if dir_name else '.'
+            tmp_path = f"{output_path}.tmp"
+            try:
+                with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED,
+                                     compresslevel=config['compression_level'], allowZip64=True) as zf:
+                    # 归档内路径以目标目录名开头，与在父目录执行 zip -r 一致
+                    # 与 zip -r 一样跟随符号链接目录；记录每条路径上已进入的真实目录，链接指回上层目录时跳过以免无限循环
+                    ancestors = {dir_path: {os.path.realpath(dir_path)}}
+                    for root, dirs, files in os.walk(dir_path, followlinks=True):
+                        chain = ancestors.pop(root)
+                        kept = []
+                        for d in dirs:
+                            sub_dir = os.path.join(root, d)
+                            real = os.path.realpath(sub_dir)
+                            if real not in chain:
+                                ancestors[sub_dir] = chain | {real}
+                                kept.append(d)
+                        dirs[:] = kept
+                        zf.write(root, os.path.relpath(root, parent_dir))
+                        for f in files:
+                            file_path = os.path.join(root, f)
+                            # 与 zip -r 一样跳过指向不存在目标的符号链接
+                            if os.path.exists(file_path):
+                                zf.write(file_path, os.path.relpath(file_path, parent_dir))
+                # 写完再改名，避免中断时留下不完整的压缩包被当作已压缩跳过
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
         else:
             # 使用Python内置的shutil.make_archive
             root_dir = os.path.dirname(dir_path)
@@ -108,23 +126,10 @@ def compress_directory(dir_path, output_path=None, config=None):
                 'output_path': output_path,
                 'input_size': input_size,
                 'output_size': output_size,
-                'saved': input_size - output_size,
-                'compression_ratio': output_size / max(1, input_size),
+                **size_stats(input_size, output_size),
                 'time': elapsed_time
             }
         
-        # 执行zip命令
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=config['timeout'], cwd=cwd)
-        
-        if result.returncode != 0:
-            # 压缩失败
-            return {
-                'success': False, 
-                'error': f"压缩失败: {result.stderr}", 
-                'input_path': dir_path,
-                'input_size': input_size
-            }
-        
         # 检查输出文件
         if not os.path.exists(output_path):
             return {
@@ -134,9 +139,7 @@ def compress_directory(dir_path, output_path=None, config=None):
                 'input_size': input_size
             }
         
-        # 计算压缩比和节省的空间
         output_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
-        compression_ratio = output_size / max(1, input_size)
         
         # 如果设置为删除原始目录
         if config['delete_original']:
@@ -154,18 +157,10 @@ def compress_directory(dir_path, output_path=None, config=None):
             'output_path': output_path,
             'input_size': input_size,
             'output_size': output_size,
-            'saved': input_size - output_size,
-            'compression_ratio': compression_ratio,
+            **size_stats(input_size, output_size),
             'time': elapsed_time
         }
         
-    except subprocess.TimeoutExpired:
-        return {
-            'success': False,
-            'error': '处理超时',
-            'input_path': dir_path,
-            'input_size': input_size
-        }
     except Exception as e:
         return {
             'success': False,
@@ -174,14 +169,30 @@ def compress_directory(dir_path, output_path=None, config=None):
             'input_size': input_size
         }
 
+def size_stats(input_size, output_size):
+    """计算节省的空间和压缩比；未统计原目录大小时均为None"""
+    if input_size is None:
+        return {'saved': None, 'compression_ratio': None}
+    return {
+        'saved': input_size - output_size,
+        'compression_ratio': output_size / max(1, input_size)
+    }
+
 def get_dir_size(path):
-    """获取目录大小（字节）"""
+    """获取目录大小（字节），不计符号链接；与 os.walk 一样跳过无法读取的子目录"""
     total_size = 0
-    for dirpath, _, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if not os.path.islink(fp):
-                total_size += os.path.getsize(fp)
+    stack = [path]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total_size += entry.stat(follow_symlinks=False).st_size
     return total_size
 
 def find_dirs(base_dir, patterns=None, recursive=False):
@@ -199,29 +210,34 @@ def find_dirs(base_dir, patterns=None, recursive=False):
     if patterns is None:
         patterns = ['*']
     
-    dirs = []
+    # 将所有模式合并为一个正则，一次遍历完成匹配
+    rx = re.compile('|'.join(f'(?:{fnmatch.translate(p)})' for p in patterns))
+    
+    matches = set()
     try:
-        # 获取所有子目录
-        all_dirs = []
-        if recursive:
-            for root, subdirs, _ in os.walk(base_dir):
-                all_dirs.extend([os.path.join(root, d) for d in subdirs])
-        else:
-            all_dirs = [os.path.join(base_dir, d) for d in os.listdir(base_dir) 
-                       if os.path.isdir(os.path.join(base_dir, d))]
-        
-        # 过滤匹配的目录
-        for pattern in patterns:
-            import fnmatch
-            matches = [d for d in all_dirs if fnmatch.fnmatch(os.path.basename(d), pattern)]
-            dirs.extend(matches)
-        
-        # 去重
-        dirs = list(set(dirs))
+        stack = [base_dir]
+        while stack:
+            root = stack.pop()
+            try:
+                it = os.scandir(root)
+            except OSError:
+                # 与 os.walk 一致，忽略无法读取的子目录
+                if root == base_dir:
+                    raise
+                continue
+            with it:
+                for entry in it:
+                    if not entry.is_dir():
+                        continue
+                    if rx.match(entry.name):
+                        matches.add(entry.path)
+                    # 与 os.walk 一致，不进入符号链接目录
+                    if recursive and not entry.is_symlink():
+                        stack.append(entry.path)
     except Exception as e:
         print(f"查找目录时出错: {e}")
     
-    return dirs
+    return list(matches)
 
 def compress_target(target_path, config=None):
     """
@@ -247,6 +263,11 @@ def compress_target(target_path, config=None):
             'input_path': target_path
         }
 
+def _worker_init():
+    """压缩子进程初始化：降低优先级，避免抢占主进程的进度显示"""
+    if hasattr(os, 'nice'):
+        os.nice(5)
+
 def main():
     """主程序入口"""
     parser = argparse.ArgumentParser(description='批量压缩目录工具')
@@ -257,19 +278,19 @@ def main():
     parser.add_argument('--level', type=int, choices=range(1, 10), 
                         default=CONFIG['compression_level'], help='压缩级别 (仅对zip格式有效)')
     parser.add_argument('--workers', type=int, default=CONFIG['max_workers'], 
-                        help='并行压缩的工作线程数')
+                        help='并行压缩的工作进程数')
     parser.add_argument('--batch', type=int, default=CONFIG['batch_size'], 
                         help='每批处理的目录数量')
     parser.add_argument('--delete', action='store_true', 
                         help='压缩后删除原始目录')
     parser.add_argument('--no-skip', action='store_true', 
                         help='不跳过已压缩的目录')
+    parser.add_argument('--no-ratio', action='store_true', 
+                        help='不统计原目录大小和压缩率 (省去每个目录的完整遍历)')
     parser.add_argument('--patterns', type=str, nargs='+', default=['BV*'], 
                         help='目录名匹配模式 (使用通配符)')
     parser.add_argument('--recursive', action='store_true', 
                         help='递归查找子目录')
-    parser.add_argument('--timeout', type=int, default=CONFIG['timeout'], 
-                        help='压缩命令超时时间(秒)')
     parser.add_argument('--output-dir', type=str, default=None, 
                         help='输出目录 (默认与输入目录相同)')
     parser.add_argument('--output-file', type=str, default=None, 
@@ -285,7 +306,7 @@ def main():
     config['batch_size'] = args.batch
     config['delete_original'] = args.delete
     config['skip_compressed'] = not args.no_skip
-    config['timeout'] = args.timeout
+    config['compute_ratio'] = not args.no_ratio
     
     # 查找符合条件的目录
     target_dirs = []
@@ -317,7 +338,9 @@ def main():
         print(f"处理批次 {i//config['batch_size'] + 1}/{num_batches}, 共 {len(batch)} 个目录")
         
         batch_results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=config['max_workers']) as executor:
+        # 压缩是CPU密集型任务，使用多进程绕开GIL
+        with concurrent.futures.ProcessPoolExecutor(max_workers=config['max_workers'],
+                                                    initializer=_worker_init) as executor:
             # 为每个目录提交压缩任务
             future_to_dir = {}
             for dir_path in batch:
@@ -345,6 +368,8 @@ def main():
                         if result['success']:
                             if result.get('skipped', False):
                                 status = '已跳过'
+                            elif result.get('compression_ratio') is None:
+                                status = f"已压缩 (输出 {result['output_size']:.1f} MB)"
                             else:
                                 ratio = result.get('compression_ratio', 0) * 100
                                 saved = result.get('saved', 0)
@@ -369,23 +394,26 @@ def main():
         # 计算并显示批次统计信息
         success_count = sum(1 for r in batch_results if r['success'])
         fail_count = len(batch_results) - success_count
-        total_input = sum(r.get('input_size', 0) for r in batch_results)
-        total_output = sum(r.get('output_size', 0) for r in batch_results if r['success'])
-        total_saved = sum(r.get('saved', 0) for r in batch_results if r['success'] and 'saved' in r)
+        total_input = sum(r.get('input_size') or 0 for r in batch_results)
+        total_output = sum(r.get('output_size', 0) for r in batch_results if r['success'] and not r.get('skipped'))
+        total_saved = sum(r['saved'] for r in batch_results if r['success'] and r.get('saved') is not None)
         avg_ratio = total_output / max(1, total_input) * 100
         
         print(f"批次 {i//config['batch_size'] + 1} 完成: {success_count} 成功, {fail_count} 失败")
-        print(f"总输入: {total_input:.1f} MB, 总输出: {total_output:.1f} MB")
-        print(f"节省空间: {total_saved:.1f} MB, 平均压缩率: {avg_ratio:.1f}%")
+        if config['compute_ratio']:
+            print(f"总输入: {total_input:.1f} MB, 总输出: {total_output:.1f} MB")
+            print(f"节省空间: {total_saved:.1f} MB, 平均压缩率: {avg_ratio:.1f}%")
+        else:
+            print(f"总输出: {total_output:.1f} MB")
     
     # 总结统计
     elapsed_time = time.time() - start_time
     success_count = sum(1 for r in results if r['success'])
     fail_count = len(results) - success_count
     
-    total_input = sum(r.get('input_size', 0) for r in results)
-    total_output = sum(r.get('output_size', 0) for r in results if r['success'])
-    total_saved = sum(r.get('saved', 0) for r in results if r['success'] and 'saved' in r)
+    total_input = sum(r.get('input_size') or 0 for r in results)
+    total_output = sum(r.get('output_size', 0) for r in results if r['success'] and not r.get('skipped'))
+    total_saved = sum(r['saved'] for r in results if r['success'] and r.get('saved') is not None)
     
     if total_input > 0:
         avg_ratio = total_output / total_input * 100
@@ -397,8 +425,11 @@ def main():
     
     print("\n----------- 总结 -----------")
     print(f"处理了 {len(results)} 个目录, {success_count} 成功, {fail_count} 失败")
-    print(f"总输入: {total_input:.1f} MB, 总输出: {total_output:.1f} MB")
-    print(f"节省空间: {total_saved:.1f} MB, 平均压缩率: {avg_ratio:.1f}%")
+    if config['compute_ratio']:
+        print(f"总输入: {total_input:.1f} MB, 总输出: {total_output:.1f} MB")
+        print(f"节省空间: {total_saved:.1f} MB, 平均压缩率: {avg_ratio:.1f}%")
+    else:
+        print(f"总输出: {total_output:.1f} MB")
     print(f"总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
     
     # 保存结果
@@ -12,10 +12,14 @@ Version: 1.0.0
 """
 
 import pandas as pd
+import pyarrow as pa
 import pyarrow.parquet as pq
 from tqdm import tqdm
 from typing import Optional, List
 
+# Columns used by process_video_data; pass as main(columns=PROCESS_COLUMNS) for a narrowed output
+PROCESS_COLUMNS = ['avid', 'pub', 'date']
+
 def convert_stata_to_parquet(
     input_path: str, 
     output_path: str, 
@@ -29,30 +33,44 @@ def convert_stata_to_parquet(
         output_path: Path for the output Parquet file
         chunksize: Number of rows to read at a time
     """
+    writer = None
     try:
         with tqdm(desc="Converting Progress", unit="rows") as pbar:
-            chunks = []
+            # Write each chunk as it is read so peak memory stays at one chunk
             for chunk in pd.read_stata(input_path, chunksize=chunksize):
-                chunks.append(chunk)
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(
+                        output_path, table.schema,
+                        compression='zstd', compression_level=3
+                    )
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
                 pbar.update(len(chunk))
-            
-            pd.concat(chunks).to_parquet(output_path, index=False)
         print(f"File successfully converted to: {output_path}")
     except Exception as e:
         print(f"Error during conversion: {str(e)}")
+    finally:
+        if writer is not None:
+            writer.close()
 
-def load_parquet_data(file_path: str) -> pd.DataFrame:
+def load_parquet_data(
+    file_path: str,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
     """
     Load data from Parquet file
     
     Args:
         file_path: Path to the Parquet file
+        columns: Columns to read (None reads all columns)
     
     Returns:
         pandas DataFrame
     """
     try:
-        table = pq.read_table(file_path)
+        table = pq.read_table(file_path, columns=columns, use_threads=True, pre_buffer=True)
         return table.to_pandas()
     except Exception as e:
         print(f"Error reading Parquet file: {str(e)}")
@@ -76,19 +94,19 @@ def process_video_data(
     """
     try:
         # Calculate time difference
-        df = df.copy()
-        df['time_diff'] = df['date'] - df['pub']
+        time_diff = df['date'] - df['pub']
         
         # Exclude negative time differences (if required)
         if exclude_negative_diff:
-            df = df[df['time_diff'] != pd.Timedelta(days=-1)]
+            keep = time_diff != pd.Timedelta(days=-1)
+            df, time_diff = df.loc[keep], time_diff.loc[keep]
         
-        # Calculate maximum time difference for each video and filter valid videos
-        max_time_diff = df.groupby('avid')['time_diff'].max()
-        valid_videos = max_time_diff[max_time_diff >= pd.Timedelta(days=min_days)]
+        # Broadcast each video's maximum time difference back to its rows
+        max_time_diff = time_diff.groupby(df['avid'], sort=False).transform('max')
+        valid = max_time_diff >= pd.Timedelta(days=min_days)
         
         # Filter final data
-        return df[df['avid'].isin(valid_videos.index)]
+        return df.loc[valid].assign(time_diff=time_diff.loc[valid])
     
     except Exception as e:
         print(f"Error processing data: {str(e)}")
@@ -98,7 +116,8 @@ def main(
     stata_file: str,
     parquet_file: str,
     min_days: int = 30,
-    chunksize: int = 30000
+    chunksize: int = 30000,
+    columns: Optional[List[str]] = None
 ) -> Optional[pd.DataFrame]:
     """
     Main function integrating all processing steps
@@ -108,6 +127,8 @@ def main(
         parquet_file: Path to Parquet file
         min_days: Minimum days requirement
         chunksize: Chunk size for data reading
+        columns: Columns to load from the Parquet file (None loads all;
+                 PROCESS_COLUMNS keeps only what process_video_data needs)
     
     Returns:
         Processed DataFrame
@@ -116,7 +137,7 @@ def main(
     convert_stata_to_parquet(stata_file, parquet_file, chunksize)
     
     # Load data
-    df = load_parquet_data(parquet_file)
+    df = load_parquet_data(parquet_file, columns)
     if df is None:
         return None
     
@@ -1,70 +1,73 @@
-import pandas as pd
 import numpy as np
-import gc  # 添加垃圾回收模块
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bilibili_utils import av2bv_array
 
-# 定义av号转bv号的函数
-def av2bv(av):
-    table = 'fZodR9XQDSUm21yCkr6zBqiveYah8bt4xsWpHnJE7jL5VG3guMTKNPAwcF'
-    tr = {}
-    for i in range(58):
-        tr[table[i]] = i
-    s = [11, 10, 3, 8, 4, 6]
-    xor = 177451812
-    add = 8728348608
-    
-    av = int(av)
-    x = (av ^ xor) + add
-    r = list('BV1  4 1 7  ')
-    for i in range(6):
-        r[s[i]] = table[x // 58 ** i % 58]
-    return ''.join(r)
+# 按 (avid, day_since_pub) 排好序后，返回拥有完整 full_days 天数据的 avid 所在行的布尔掩码
+# 通过相邻行比较做游程统计，代替 groupby().nunique() + isin() 的两次哈希扫描
+def complete_days_mask(avid, day, full_days):
+    n = len(avid)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    group_start = np.empty(n, dtype=bool)
+    group_start[0] = True
+    group_start[1:] = avid[1:] != avid[:-1]
+    new_day = group_start.copy()
+    new_day[1:] |= day[1:] != day[:-1]
+    starts = np.flatnonzero(group_start)
+    distinct_days = np.add.reduceat(new_day, starts, dtype=np.intp)
+    group_sizes = np.diff(np.append(starts, n))
+    return np.repeat(distinct_days == full_days, group_sizes)
 
-# 读取parquet文件
-file_path = 'sampled_avid.parquet'
-df = pd.read_parquet(file_path)    
+# 统一转换为 timestamp 类型（相当于 pd.to_datetime），作用于扫描表达式
+def to_timestamp(field, field_type):
+    if pa.types.is_timestamp(field_type):
+        return field
+    return field.cast(pa.timestamp('us'))
 
-# 确保日期字段为 datetime 类型
-df['pub_date'] = pd.to_datetime(df['pub_date'])
-df['data_date'] = pd.to_datetime(df['data_date'])
+NS_PER_DAY = 86400 * 10 ** 9
 
-# 计算从发布日起的天数
-df['day_since_pub'] = (df['data_date'] - df['pub_date']).dt.days
+# 两个时间相差的整天数，向下取整（相当于 (end - start).dt.days），
+# 而不是 days_between 那样统计跨过的日期边界数，时间戳带有时分秒时两者不同
+def elapsed_days(start, end):
+    ns = pa.timestamp('ns')
+    elapsed_ns = pc.subtract(end.cast(ns), start.cast(ns)).cast(pa.int64())
+    return pc.floor(pc.divide(elapsed_ns.cast(pa.float64()), float(NS_PER_DAY))).cast(pa.int64())
 
-# 保留 day_since_pub 在 0 到 29 天之间的数据（即前30天）
-full_days = 30 
-df = df[(df['day_since_pub'] >= 0) & (df['day_since_pub'] <  full_days)]
-gc.collect()  # 回收内存
+# 读取parquet文件（直接在 Arrow 列式内存上处理，不经过 pandas）
+file_path = 'sampled_avid.parquet'
+dataset = ds.dataset(file_path, format='parquet')
 
-# 找出有完整30天数据的 avid
-avid_day_counts = df.groupby('avid')['day_since_pub'].nunique()
-complete_avids = avid_day_counts[avid_day_counts == full_days].index
-clean_df = df[df['avid'].isin(complete_avids)].copy()
-# 释放不再需要的变量
-del df, avid_day_counts
-gc.collect()  # 回收内存
+# 投影列：丢弃 unnamed0，日期字段转为 datetime 类型，并计算从发布日起的天数
+columns = {name: pc.field(name) for name in dataset.schema.names if name != 'unnamed0'}
+for col in ('pub_date', 'data_date'):
+    columns[col] = to_timestamp(pc.field(col), dataset.schema.field(col).type)
+columns['day_since_pub'] = elapsed_days(columns['pub_date'], columns['data_date'])
 
-# 筛选 duration >= 120 且 <= 128 的记录
+# 保留前30天（day_since_pub 在 0 到 29 之间）且 duration 在 120 到 128 之间的记录
+# 某 avid 在 duration 筛选后仍有完整30天数据，则筛选前必然也完整，所以只需做一次完整性检查
+# 筛选条件下推到扫描阶段，不满足条件的行不会被整体物化
+full_days = 30
 min_duration = 120
 max_duration = 128
+day_since_pub = columns['day_since_pub']
+tbl = dataset.to_table(
+    columns=columns,
+    filter=(day_since_pub >= 0) & (day_since_pub < full_days)
+    & (pc.field('duration') >= min_duration) & (pc.field('duration') <= max_duration)
+)
 
-filtered_df = clean_df[(clean_df['duration'] >= min_duration) & (clean_df['duration'] <= max_duration)].copy()
-del clean_df
-gc.collect()  # 回收内存
-
-# 再次检查这些 avid 是否依然有完整30天数据
-avid_day_counts_filtered = filtered_df.groupby('avid')['day_since_pub'].nunique()
-final_avids = avid_day_counts_filtered[avid_day_counts_filtered == 30].index
-step_1_df = filtered_df[filtered_df['avid'].isin(final_avids)].copy()
-del filtered_df, avid_day_counts_filtered, final_avids
-gc.collect()  # 回收内存
-
-del step_1_df['unnamed0']
+# 按 avid、day_since_pub 排序后，只保留有完整30天数据的 avid
+tbl = tbl.sort_by([('avid', 'ascending'), ('day_since_pub', 'ascending')])
+mask = complete_days_mask(tbl['avid'].to_numpy(), tbl['day_since_pub'].to_numpy(), full_days)
+step_1_tbl = tbl.filter(pa.array(mask))
+del tbl, mask
 
-# 使用av2bv函数创建bvid列
-step_1_df['bvid'] = step_1_df['avid'].apply(lambda x: av2bv(x))
-print(len(step_1_df))
+# 使用向量化的av2bv_array创建bvid列
+step_1_tbl = step_1_tbl.append_column('bvid', pa.array(av2bv_array(step_1_tbl['avid'].to_numpy())))
+print(step_1_tbl.num_rows)
 
-step_1_df.to_parquet('step_1_df.parquet', index=False)
-# 如果不再需要 step_1_df，可以释放
-del step_1_df
-gc.collect() 
\ No newline at end of file
+# 列类型已变化，去掉源文件带来的 pandas 元数据，以免读回时被还原成旧类型
+pq.write_table(step_1_tbl.replace_schema_metadata(None), 'step_1_df.parquet')
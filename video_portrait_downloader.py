@@ -1,38 +1,62 @@
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 import os
 import random
+import shutil
+import struct
 from tqdm import tqdm
-import cv2
+from tqdm.contrib.logging import logging_redirect_tqdm
+import subprocess
 import time
 import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from bilibili_api_client import BilibiliDownloader
 
+# 逐个视频的信息为 DEBUG 级别，默认不输出；显示进度条期间日志经 logging_redirect_tqdm 输出，避免打断进度条
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+log = logging.getLogger(__name__)
+
 # 记录开始时间
 start_time = time.time()
 start_time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-print(f"下载任务开始时间: {start_time_str}")
-
-# 读取 parquet 文件
-df = pd.read_parquet('step_1_df.parquet')
+log.info(f"下载任务开始时间: {start_time_str}")
 
-# 提取唯一的 bvid
-unique_bvids = df['bvid'].unique().tolist()
+# 读取 parquet 文件中的 bvid 列（只读取这一列），并提取唯一的 bvid
+unique_bvids = pq.read_table('step_1_df.parquet', columns=['bvid']).column('bvid').unique().to_pylist()
 
 # 随机打乱 bvids
 random.shuffle(unique_bvids)
 
 # 存储已下载的视频信息
 downloaded_videos = []
-# 检查是否有之前的保存进度
+# 检查是否有之前的保存进度（每行一个bvid，首行为表头，仍是合法的CSV）
 progress_file = 'portrait_videos_progress.csv'
 if os.path.exists(progress_file):
     try:
-        progress_df = pd.read_csv(progress_file)
-        downloaded_videos = progress_df['bvid'].tolist()
-        print(f"已从进度文件加载 {len(downloaded_videos)} 个下载记录")
+        with open(progress_file) as f:
+            downloaded_videos = [line for line in f.read().splitlines() if line and line != 'bvid']
+        log.info(f"已从进度文件加载 {len(downloaded_videos)} 个下载记录")
     except Exception as e:
-        print(f"读取进度文件失败: {e}")
+        log.warning(f"读取进度文件失败: {e}")
+else:
+    with open(progress_file, 'w') as f:
+        f.write('bvid\n')
+# 已下载bvid的集合，用于O(1)的成员检查（列表保留下载顺序用于输出）
+downloaded_set = set(downloaded_videos)
+
+# 记录一个竖屏视频：追加写入进度文件，每次只写一行，无需重写整个文件
+def record_progress(bvid):
+    downloaded_videos.append(bvid)
+    downloaded_set.add(bvid)
+    with open(progress_file, 'a') as f:
+        f.write(bvid + '\n')
+
+# 保存最终结果
+def save_results():
+    result_df = pd.DataFrame({'bvid': downloaded_videos})
+    result_df.to_csv('portrait_videos.csv', index=False)
 
 target_count = 2146  # 目标下载数量
 batch_size = 100  # 每批下载数量
@@ -44,95 +68,228 @@ downloader = BilibiliDownloader(base_path=base_path)
 # 创建保存目录
 os.makedirs(base_path, exist_ok=True)
 
+# 单独的视频轨道/音频轨道文件后缀
+VIDEO_SUFFIX = '_video.mp4'
+AUDIO_SUFFIX = '_audio.mp4'
+TRACK_SUFFIXES = (VIDEO_SUFFIX, AUDIO_SUFFIX)
+
+# 查找目录中第一个合并后的MP4文件（非单独的视频/音频轨道），返回完整路径或None
+def find_merged_mp4(video_dir):
+    with os.scandir(video_dir) as it:
+        for entry in it:
+            name = entry.name
+            if name.endswith('.mp4') and not name.endswith(TRACK_SUFFIXES):
+                return entry.path
+    return None
+
 # 检查已存在的视频文件
 def get_existing_videos(directory):
     existing_videos = set()
     if os.path.exists(directory):
-        for bvid in os.listdir(directory):
-            video_dir = os.path.join(directory, bvid)
-            if os.path.isdir(video_dir):
+        with os.scandir(directory) as it:
+            for entry in it:
                 # 检查是否有完整视频文件
-                mp4_files = [f for f in os.listdir(video_dir) if f.endswith('.mp4') and not (f.endswith('_video.mp4') or f.endswith('_audio.mp4'))]
-                if mp4_files:
-                    existing_videos.add(bvid)
+                if entry.is_dir(follow_symlinks=False) and find_merged_mp4(entry.path):
+                    existing_videos.add(entry.name)
     return existing_videos
 
 # 获取已存在的视频列表
-print("正在检查已存在的视频文件...")
+log.info("正在检查已存在的视频文件...")
 existing_videos = get_existing_videos(base_path)
-print(f"找到 {len(existing_videos)} 个已存在的视频")
+log.info(f"找到 {len(existing_videos)} 个已存在的视频")
 
 
+# 竖屏检查结果缓存，键为 (路径, 文件大小, 修改时间)，文件未变化时不重复探测
+portrait_cache = {}
+
+# 解析MP4盒子头部（4字节大小 + 4字节类型，大小为1时后跟8字节的实际大小，为0时延伸到末尾）
+# 返回 (盒子大小, 类型, 头部长度)
+def parse_box_header(header, remaining):
+    size, box_type = struct.unpack_from('>I4s', header)
+    header_size = 8
+    if size == 1:
+        size = struct.unpack_from('>Q', header, 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = remaining
+    return size, box_type, header_size
+
+# 遍历内存中一段盒子数据，产出 (类型, 内容起始位置, 内容结束位置)
+def iter_boxes(data, start, end):
+    pos = start
+    while pos + 8 <= end:
+        size, box_type, header_size = parse_box_header(data[pos:pos + 16], end - pos)
+        if size < header_size or pos + size > end:
+            return
+        yield box_type, pos + header_size, pos + size
+        pos += size
+
+# 直接解析MP4的 moov/trak/tkhd 盒子读取视频宽高，不启动任何子进程
+# 返回第一个宽高都非零的轨道（音频轨道的宽高为0），解析失败时返回None
+def read_mp4_size(video_path):
+    with open(video_path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        # 在顶层盒子中寻找 moov（可能位于 mdat 之后），跳过其他盒子
+        moov = None
+        pos = 0
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            size, box_type, header_size = parse_box_header(f.read(16), file_size - pos)
+            if size < header_size:
+                return None
+            if box_type == b'moov':
+                f.seek(pos + header_size)
+                moov = f.read(size - header_size)
+                break
+            pos += size
+    if moov is None:
+        return None
+    
+    for box_type, trak_start, trak_end in iter_boxes(moov, 0, len(moov)):
+        if box_type != b'trak':
+            continue
+        for sub_type, start, end in iter_boxes(moov, trak_start, trak_end):
+            if sub_type != b'tkhd':
+                continue
+            # 版本0与版本1的时间字段长度不同，宽高（16.16定点数）位于矩阵之后
+            offset = start + (88 if moov[start] == 1 else 76)
+            if offset + 8 > end:
+                break
+            width, height = struct.unpack_from('>II', moov, offset)
+            width, height = width >> 16, height >> 16
+            if width and height:
+                return width, height
+            break
+    return None
+
+# 读取视频流的宽高：ffprobe 只解析容器头部信息，无需解码任何帧
+def ffprobe_video_size(video_path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+         '-show_entries', 'stream=width,height', '-of', 'csv=s=x:p=0', video_path],
+        capture_output=True, text=True, timeout=5
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return None
+    width, height = lines[0].split('x')[:2]
+    return int(width), int(height)
+
+# 优先直接解析MP4头部，解析失败（非常规文件）时才回退到 ffprobe
+def probe_video_size(video_path):
+    try:
+        size = read_mp4_size(video_path)
+    except (OSError, struct.error):
+        size = None
+    if size is None:
+        size = ffprobe_video_size(video_path)
+    return size
+
 # 检查视频是否为竖屏（宽高比 <= 1）
 def is_portrait_video(video_path):
     try:
         if not os.path.exists(video_path):
-            print(f"视频文件不存在: {video_path}")
-            return False
-            
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(f"无法打开视频文件: {video_path}")
+            log.warning(f"视频文件不存在: {video_path}")
             return False
         
-        # 尝试读取第一帧
-        ret, _ = cap.read()
-        if not ret:
-            print(f"无法读取视频帧: {video_path}")
-            cap.release()
+        st = os.stat(video_path)
+        cache_key = (video_path, st.st_size, st.st_mtime_ns)
+        if cache_key in portrait_cache:
+            return portrait_cache[cache_key]
+        
+        size = probe_video_size(video_path)
+        if size is None:
+            log.warning(f"无法读取视频信息: {video_path}")
             return False
-            
-        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        cap.release()
+        width, height = size
         
         if width <= 0 or height <= 0:
-            print(f"视频维度无效: {video_path}, 宽={width}, 高={height}")
+            log.warning(f"视频维度无效: {video_path}, 宽={width}, 高={height}")
             return False
             
         aspect_ratio = width / height
-        print(f"视频: {video_path}, 宽高比: {aspect_ratio:.2f} ({width}x{height})")
-        return aspect_ratio <= 1  # 竖屏视频
+        log.debug("视频: %s, 宽高比: %.2f (%dx%d)", video_path, aspect_ratio, width, height)
+        portrait_cache[cache_key] = aspect_ratio <= 1  # 竖屏视频
+        return portrait_cache[cache_key]
     except Exception as e:
-        print(f"检查视频尺寸时出错: {video_path}, 错误: {e}")
+        log.warning(f"检查视频尺寸时出错: {video_path}, 错误: {e}")
         return False
 
+# 删除视频文件夹，成功时返回None，失败时返回异常
+def remove_video_dir(video_dir):
+    try:
+        shutil.rmtree(video_dir)
+        return None
+    except Exception as e:
+        return e
+
 # 检查已存在的视频是否为竖屏
-print("检查已存在视频的宽高比...")
-for bvid in tqdm(existing_videos):
-    if len(downloaded_videos) >= target_count:
-        break
-        
-    if bvid in downloaded_videos:
+log.info("检查已存在视频的宽高比...")
+candidates = []
+for bvid in existing_videos:
+    if bvid in downloaded_set:
         continue
         
-    video_dir = os.path.join(base_path, bvid)
-    mp4_files = [f for f in os.listdir(video_dir) if f.endswith('.mp4') and not (f.endswith('_video.mp4') or f.endswith('_audio.mp4'))]
-    
-    if mp4_files:
-        video_path = os.path.join(video_dir, mp4_files[0])
-        if is_portrait_video(video_path):
-            downloaded_videos.append(bvid)
-            print(f"已有竖屏视频: {bvid}, 当前总数: {len(downloaded_videos)}/{target_count}")
+    video_path = find_merged_mp4(os.path.join(base_path, bvid))
+    if video_path:
+        candidates.append((bvid, video_path))
+
+# 每次探测只需读取文件头部的 moov/tkhd 盒子（解析失败时才启动 ffprobe 子进程），以磁盘读取为主，使用线程池让各个文件的读取相互重叠
+if candidates and len(downloaded_videos) < target_count:
+    probe_workers = min(32, (os.cpu_count() or 1) * 4)
+    with logging_redirect_tqdm(), ThreadPoolExecutor(max_workers=probe_workers) as executor:
+        future_to_bvid = {executor.submit(is_portrait_video, path): bvid for bvid, path in candidates}
+        for future in tqdm(as_completed(future_to_bvid), total=len(future_to_bvid)):
+            if future.result():
+                bvid = future_to_bvid[future]
+                record_progress(bvid)
+                log.debug("已有竖屏视频: %s, 当前总数: %d/%d", bvid, len(downloaded_videos), target_count)
+                if len(downloaded_videos) >= target_count:
+                    # 已达到目标数量，取消尚未开始的探测
+                    executor.shutdown(cancel_futures=True)
+                    break
 
 # 如果已经达到目标数量，提前结束
 if len(downloaded_videos) >= target_count:
-    print(f"已有足够的竖屏视频 ({len(downloaded_videos)}/{target_count})，无需下载")
+    log.info(f"已有足够的竖屏视频 ({len(downloaded_videos)}/{target_count})，无需下载")
     # 保存结果
-    result_df = pd.DataFrame({'bvid': downloaded_videos})
-    result_df.to_csv('portrait_videos.csv', index=False)
+    save_results()
+    downloader.close()
     exit(0)
 
-# 保存进度的函数
-def save_progress():
-    progress_df = pd.DataFrame({'bvid': downloaded_videos})
-    progress_df.to_csv(progress_file, index=False)
-    print(f"进度已保存，当前已下载 {len(downloaded_videos)} 个视频")
-
-# 定义上次保存时间
-last_save_time = time.time()
-save_interval = 300  # 每5分钟保存一次进度
-
+# 筛选一个刚下载完成的视频：保留竖屏视频，非竖屏视频的文件夹记入 to_delete，批次结束后统一删除
+# 作为 batch_download 的 on_complete 回调，在其余视频仍在下载时执行
+def check_downloaded_video(record):
+    global successful_in_batch
+    bvid = record['bvid']
+    # 已经达到目标数量，不再筛选本批次剩余的视频
+    if len(downloaded_videos) >= target_count:
+        return
+    
+    video_dir = os.path.join(base_path, bvid)
+    # 检查下载的视频是否存在
+    if not os.path.exists(video_dir):
+        return
+        
+    # 寻找合并后的MP4文件
+    video_path = find_merged_mp4(video_dir)
+    
+    # 如果没有合并文件，直接使用视频文件检查是否为竖屏，不再合并
+    if video_path is None and os.path.exists(os.path.join(video_dir, f'{bvid}{VIDEO_SUFFIX}')):
+        video_path = os.path.join(video_dir, f'{bvid}{VIDEO_SUFFIX}')
+        
+    if video_path is None or not os.path.exists(video_path):
+        log.warning(f"视频文件不存在: {bvid}")
+        return
+    
+    if is_portrait_video(video_path):
+        record_progress(bvid)
+        log.debug("保留竖屏视频: %s, 当前总数: %d/%d", bvid, len(downloaded_videos), target_count)
+        successful_in_batch += 1
+    else:
+        # 非竖屏视频的文件夹先记录下来，批次结束后统一删除
+        log.debug("检测到非竖屏视频: %s", bvid)
+        to_delete.append(video_dir)
 
 # 开始下载过程
 current_batch_number = 1
@@ -142,7 +299,7 @@ while len(downloaded_videos) < target_count and unique_bvids:
     current_batch = unique_bvids[:batch_size]
     unique_bvids = unique_bvids[batch_size:]
     
-    print(f"下载批次 #{current_batch_number}，当前进度: {len(downloaded_videos)}/{target_count}，本批次大小: {len(current_batch)}")
+    log.info(f"下载批次 #{current_batch_number}，当前进度: {len(downloaded_videos)}/{target_count}，本批次大小: {len(current_batch)}")
     current_batch_number += 1
     
     # 创建批次数据框
@@ -152,91 +309,47 @@ while len(downloaded_videos) < target_count and unique_bvids:
     new_batch = []
     for bvid in current_batch:
         if bvid in existing_videos:
-            print(f"视频已存在，跳过下载: {bvid}")
-        elif bvid in downloaded_videos:
-            print(f"视频已处理，跳过下载: {bvid}")
+            log.debug("视频已存在，跳过下载: %s", bvid)
+        elif bvid in downloaded_set:
+            log.debug("视频已处理，跳过下载: %s", bvid)
         else:
             new_batch.append(bvid)
     
     if not new_batch:
-        print(f"批次 #{current_batch_number} 中所有视频都已存在或处理，跳过下载")
+        log.info(f"批次 #{current_batch_number} 中所有视频都已存在或处理，跳过下载")
         continue
     
-    print(f"批次 #{current_batch_number} 过滤后需要下载的视频数: {len(new_batch)}/{len(current_batch)}")
+    log.info(f"批次 #{current_batch_number} 过滤后需要下载的视频数: {len(new_batch)}/{len(current_batch)}")
     batch_df = pd.DataFrame({'bvid': new_batch})
     
+    # 每个视频下载完成后立即筛选竖屏视频，与本批次其余视频的下载重叠进行
+    log.info("开始下载并筛选本批次视频...")
+    successful_in_batch = 0
+    to_delete = []
+    
     try:
         # 下载当前批次
-        downloader.batch_download(batch_df)
+        with logging_redirect_tqdm():
+            downloader.batch_download(batch_df, on_complete=check_downloaded_video)
     except Exception as e:
-        print(f"批次下载过程中出错: {e}")
+        log.error(f"批次下载过程中出错: {e}")
         # 继续处理已下载的内容
     
-    # 检查是否创建了视频目录
-    if not os.path.exists(base_path):
-        print(f"视频保存目录不存在: {base_path}")
-        os.makedirs(base_path, exist_ok=True)
-        
-    # 检查已下载的视频，筛选竖屏视频
-    print(f"开始筛选本批次视频...")
-    successful_in_batch = 0
-    
-    for bvid in tqdm(new_batch, desc="筛选竖屏视频"):
-        video_dir = os.path.join(base_path, bvid)
-        # 检查下载的视频是否存在
-        if not os.path.exists(video_dir):
-            continue
-            
-        # 寻找合并后的MP4文件
-        mp4_files = [f for f in os.listdir(video_dir) if f.endswith('.mp4') and not (f.endswith('_video.mp4') or f.endswith('_audio.mp4'))]
-        
-        video_path = None
-        
-        # 如果没有合并文件，直接使用视频文件检查是否为竖屏，不再合并
-        if not mp4_files and os.path.exists(os.path.join(video_dir, f'{bvid}_video.mp4')):
-            video_path = os.path.join(video_dir, f'{bvid}_video.mp4')
-        elif mp4_files:
-            video_path = os.path.join(video_dir, mp4_files[0])
-            
-        if video_path is None or not os.path.exists(video_path):
-            print(f"视频文件不存在: {bvid}")
-            continue
-        
-        if is_portrait_video(video_path):
-            downloaded_videos.append(bvid)
-            print(f"保留竖屏视频: {bvid}, 当前总数: {len(downloaded_videos)}/{target_count}")
-            successful_in_batch += 1
-            
-            # 定期保存进度
-            current_time = time.time()
-            if current_time - last_save_time > save_interval:
-                save_progress()
-                last_save_time = current_time
-        else:
-            # 删除非竖屏视频前检查文件是否存在
-            print(f"检测到非竖屏视频: {bvid}")
-            try:
-                if os.path.exists(video_path):
-                    os.remove(video_path)
-                    print(f"已删除非竖屏视频: {bvid}")
-                    
-                    # 删除视频所在文件夹
-                    video_dir = os.path.dirname(video_path)
-                    if os.path.exists(video_dir):
-                        import shutil
-                        shutil.rmtree(video_dir)
-                        print(f"已删除视频文件夹: {video_dir}")
-            except Exception as e:
-                print(f"删除文件失败: {video_path}, 错误: {e}")
-        
-        # 如果已经达到目标数量，退出循环
-        if len(downloaded_videos) >= target_count:
-            break
+    # 并行删除本批次的非竖屏视频文件夹，让各个目录的删除操作相互重叠
+    if to_delete:
+        failed = 0
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for video_dir, error in zip(to_delete, executor.map(remove_video_dir, to_delete)):
+                if error is not None:
+                    failed += 1
+                    log.warning(f"删除视频文件夹失败: {video_dir}, 错误: {error}")
+        log.info(f"已删除 {len(to_delete) - failed} 个非竖屏视频文件夹")
 
-    print(f"批次 #{current_batch_number - 1} 完成，成功下载 {successful_in_batch} 个竖屏视频")
-    save_progress()  # 每批次结束后保存进度
+    log.info(f"批次 #{current_batch_number - 1} 完成，成功下载 {successful_in_batch} 个竖屏视频，当前已下载 {len(downloaded_videos)} 个视频")
 
-print(f"下载完成，共下载 {len(downloaded_videos)} 个竖屏视频")
+save_results()
+downloader.close()
+log.info(f"下载完成，共下载 {len(downloaded_videos)} 个竖屏视频")
 
 # 记录结束时间和总耗时
 end_time = time.time()
@@ -244,6 +357,6 @@ end_time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 duration = end_time - start_time
 hours, remainder = divmod(duration, 3600)
 minutes, seconds = divmod(remainder, 60)
-print(f"下载任务结束时间: {end_time_str}")
-print(f"总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
-print(f"平均每个视频耗时: {duration/max(1, len(downloaded_videos)):.2f}秒") 
\ No newline at end of file
+log.info(f"下载任务结束时间: {end_time_str}")
+log.info(f"总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
+log.info(f"平均每个视频耗时: {duration/max(1, len(downloaded_videos)):.2f}秒") 
\ No newline at end of file
@@ -2,25 +2,132 @@ import os
 import subprocess
 import glob
 import pandas as pd
+import pyarrow.parquet as pq
 from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 import shutil
 import concurrent.futures
+import logging
 import re
 import multiprocessing
 import time
 
+log = logging.getLogger(__name__)
+
 # 配置选项
 CONFIG = {
     'max_workers': min(8, multiprocessing.cpu_count()),  # 自动使用CPU核心数
-    'ffmpeg_threads': 2,  # 每个FFmpeg进程使用的线程数
+    'ffmpeg_threads': 0,  # 每个FFmpeg进程使用的线程数（0 表示由FFmpeg自动选择）
     'durations': [2, 4, 6, 8, 10, 12, 14, 16, 18, 20, 22, 24],  # 切片持续时间列表
     'timeout': 180,  # FFmpeg命令超时时间(秒)
     'ffmpeg_preset': 'ultrafast',  # FFmpeg编码速度预设 (ultrafast, superfast, veryfast, faster, fast, medium)
     'crf_value': 28,  # 视频质量值 (值越大，质量越低，速度越快)
-    'batch_size': 100  # 每批处理的文件数量
+    'batch_size': 100,  # 每批处理的文件数量
+    'discovery_workers': 32  # 查找文件时的并行线程数（每个任务只有少量stat调用）
 }
 
-def slice_video(video_path, output_dir=None, durations=None):
+# 单独的视频轨道/音频轨道文件后缀
+VIDEO_SUFFIX = '_video.mp4'
+AUDIO_SUFFIX = '_audio.mp4'
+TRACK_SUFFIXES = (VIDEO_SUFFIX, AUDIO_SUFFIX)
+
+def build_multi_output_cmd(input_path, outputs, codec_args):
+    """
+    构建一次FFmpeg调用生成多个切片的命令，每个输出都从0秒开始
+    
+    Args:
+        input_path (str): 输入文件路径
+        outputs (list): [(持续时间, 输出路径), ...]
+        codec_args (list): 每个输出使用的编码参数
+    
+    Returns:
+        list: FFmpeg命令参数
+    """
+    # -ss 放在 -i 之前为输入端定位；切片都从0秒开始，-noaccurate_seek 跳过精确定位所需的解码
+    # 不加输出端 -ss：流复制时输出端 -ss 0 反而会丢掉开头的帧
+    cmd = ['ffmpeg', '-y', '-noaccurate_seek', '-ss', '0', '-i', input_path]
+    for duration, output_path in outputs:
+        cmd += ['-t', str(duration), *codec_args, output_path]
+    return cmd
+
+def run_multi_output_cmd(cmd, outputs, timeout):
+    """执行多输出FFmpeg命令，返回输出路径列表；失败时删除不完整的输出后重新抛出异常"""
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except Exception:
+        for _, output_path in outputs:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        raise
+    return [output_path for _, output_path in outputs]
+
+def build_encode_args(config, audio_codec):
+    """重新编码视频时每个输出使用的编码参数"""
+    return [
+        '-c:v', 'libx264',
+        '-crf', str(config['crf_value']),
+        '-preset', config['ffmpeg_preset'],
+        '-c:a', audio_codec,
+        '-threads', str(config['ffmpeg_threads'])
+    ]
+
+def run_encode_cmd(input_path, outputs, config):
+    """重新编码视频生成切片：音频先直接复制（源文件已是AAC），FFmpeg报错时再将音频编码为aac"""
+    try:
+        cmd = build_multi_output_cmd(input_path, outputs, build_encode_args(config, 'copy'))
+        return run_multi_output_cmd(cmd, outputs, config['timeout'])
+    except subprocess.CalledProcessError:
+        cmd = build_multi_output_cmd(input_path, outputs, build_encode_args(config, 'aac'))
+        return run_multi_output_cmd(cmd, outputs, config['timeout'])
+
+def encode_video_slices(video_path, outputs, config):
+    """
+    重新编码生成视频切片（流复制失败时的回退方案）
+    先一次性编码最长的部分到临时文件，再从临时文件复制出各个切片；
+    临时文件提取失败时，直接从源文件编码所有切片
+    
+    Args:
+        video_path (str): 视频文件路径
+        outputs (list): [(持续时间, 输出路径), ...]
+        config (dict): 切片配置参数
+    
+    Returns:
+        list: 成功生成的切片文件路径列表
+    """
+    filename = os.path.basename(video_path)
+    name, ext = os.path.splitext(filename)
+    durations = [duration for duration, _ in outputs]
+    
+    # 1. 提取最长部分
+    max_duration = max(durations)
+    temp_file = os.path.join(os.path.dirname(outputs[0][1]), f"{name}_temp_0-{max_duration}s{ext}")
+    
+    try:
+        # 执行FFmpeg提取命令
+        run_encode_cmd(video_path, [(max_duration, temp_file)], config)
+        
+        # 2. 从临时文件中一次性复制出各个小片段（直接复制，非常快）
+        try:
+            segment_cmd = build_multi_output_cmd(temp_file, outputs, ['-c', 'copy'])
+            return run_multi_output_cmd(segment_cmd, outputs, config['timeout'])
+        except Exception as e:
+            log.warning(f"错误: 从临时文件切片失败: {filename} 的 {durations} 秒: {e}")
+            return []
+    except Exception as e:
+        log.warning(f"错误: 提取临时文件失败: {filename}, 错误: {e}")
+    finally:
+        # 删除临时文件
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    
+    # 回退方案：直接从源文件编码所有切片
+    try:
+        return run_encode_cmd(video_path, outputs, config)
+    except Exception as e:
+        log.warning(f"错误: 回退方案也失败: {filename} 的 {durations} 秒: {e}")
+        return []
+
+def slice_video(video_path, output_dir=None, durations=None, config=None):
     """
     对视频进行切片，切片从0秒开始，到指定的持续时间结束
     
@@ -28,18 +135,22 @@ def slice_video(video_path, output_dir=None, durations=None):
         video_path (str): 视频文件路径
         output_dir (str): 输出目录，默认为视频所在目录
         durations (list): 切片持续时间列表，单位为秒
+        config (dict): 切片配置参数，默认为CONFIG
     
     Returns:
         list: 生成的切片文件路径列表
     """
     start_time = time.time()
     if not os.path.exists(video_path):
-        print(f"错误: 文件不存在: {video_path}")
+        log.warning(f"错误: 文件不存在: {video_path}")
         return []
     
     # 设置默认参数
+    if config is None:
+        config = CONFIG
+    
     if durations is None:
-        durations = CONFIG['durations']
+        durations = config['durations']
     
     if output_dir is None:
         output_dir = os.path.dirname(video_path)
@@ -73,186 +184,65 @@ def slice_video(video_path, output_dir=None, durations=None):
             missing_durations.append(duration)
     
     if existing_slices:
-        print(f"跳过已存在的 {file_type} 切片: {name} 的 {existing_slices}")
+        log.debug("跳过已存在的 %s 切片: %s 的 %s", file_type, name, existing_slices)
     
     # 如果所有切片都已存在，则直接返回
     if not missing_durations:
-        print(f"{file_type} {name} 的所有切片已存在")
+        log.debug("%s %s 的所有切片已存在", file_type, name)
         return output_files
     
-    # 先检查输入文件是否可读 - 只在必要时检查
-    try:
-        # 使用更快的FFprobe命令检查文件有效性
-        probe_cmd = [
-            'ffprobe', 
-            '-v', 'error', 
-            '-select_streams', 'v:0' if not is_audio else 'a:0',
-            '-show_entries', 'stream=duration', 
-            '-of', 'csv=p=0',
-            video_path
-        ]
-        result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=10)
-        if result.returncode != 0:
-            print(f"错误: 无法读取文件: {video_path}, 跳过处理")
-            return output_files  # 返回已存在的切片
-    except Exception as e:
-        print(f"错误: 文件检查失败: {video_path}, 错误: {e}")
-        return output_files  # 返回已存在的切片
+    log.debug("开始处理 %s: %s (还需生成 %d 个切片)", file_type, name, len(missing_durations))
     
-    print(f"开始处理 {file_type}: {name} (还需生成 {len(missing_durations)} 个切片)")
-    
-    # 使用 FFmpeg 进行切片 - 批量模式
+    # 使用 FFmpeg 进行切片 - 批量模式：每次调用用多组输出参数一次生成所有切片
+    # 不再单独用 FFprobe 预检查文件：无法读取的文件会让 FFmpeg 返回非零退出码，由下面的异常分支处理
+    outputs = [(duration, os.path.join(output_dir, f"{name}_0-{duration}s{ext}")) for duration in missing_durations]
     try:
-        # 对于音频文件或者低于10秒的短切片，使用一次性切割
-        if is_audio or (max(missing_durations) <= 10):
-            # 一次性生成所有切片
-            for duration in missing_durations:
-                output_filename = f"{name}_0-{duration}s{ext}"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # 根据文件类型使用不同的命令
-                if is_audio:
-                    # 音频文件 - 使用复制模式，速度更快
-                    ffmpeg_cmd = [
-                        'ffmpeg', '-y',
-                        '-i', video_path,
-                        '-ss', '0',
-                        '-t', str(duration),
-                        '-c:a', 'copy',
-                        output_path
-                    ]
-                else:
-                    # 视频文件 - 使用更快的编码设置
-                    ffmpeg_cmd = [
-                        'ffmpeg', '-y',
-                        '-i', video_path,
-                        '-ss', '0',
-                        '-t', str(duration),
-                        '-c:v', 'libx264',
-                        '-crf', str(CONFIG['crf_value']),
-                        '-preset', CONFIG['ffmpeg_preset'],
-                        '-c:a', 'aac',
-                        '-threads', str(CONFIG['ffmpeg_threads']),
-                        output_path
-                    ]
-                
-                try:
-                    # 执行 FFmpeg 命令
-                    result = subprocess.run(ffmpeg_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=CONFIG['timeout'])
-                    output_files.append(output_path)
-                    success_count += 1
-                except Exception as e:
-                    print(f"错误: {file_type}切片失败: {filename} 的 0-{duration}秒: {e}")
-        else:
-            # 对于视频文件和较长切片，使用更复杂的流程
-            # 先一次性截取最长的部分，然后分割成多个短片段
-            max_duration = max(missing_durations)
-            temp_file = os.path.join(output_dir, f"{name}_temp_0-{max_duration}s{ext}")
-            
-            # 1. 提取最长部分
-            extract_cmd = [
-                'ffmpeg', '-y',
-                '-i', video_path,
-                '-ss', '0',
-                '-t', str(max_duration),
-                '-c:v', 'libx264',
-                '-crf', str(CONFIG['crf_value']),
-                '-preset', CONFIG['ffmpeg_preset'],
-                '-c:a', 'aac',
-                '-threads', str(CONFIG['ffmpeg_threads']),
-                temp_file
-            ]
-            
-            try:
-                # 执行FFmpeg提取命令
-                result = subprocess.run(extract_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=CONFIG['timeout'])
-                
-                # 2. 从临时文件中切割各个小片段
-                for duration in missing_durations:
-                    output_filename = f"{name}_0-{duration}s{ext}"
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    # 从临时文件中复制指定时长
-                    segment_cmd = [
-                        'ffmpeg', '-y',
-                        '-i', temp_file,
-                        '-ss', '0',
-                        '-t', str(duration),
-                        '-c', 'copy',  # 直接复制，非常快
-                        output_path
-                    ]
-                    
-                    try:
-                        result = subprocess.run(segment_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=CONFIG['timeout'])
-                        output_files.append(output_path)
-                        success_count += 1
-                    except Exception as e:
-                        print(f"错误: 从临时文件切片失败: {filename} 的 0-{duration}秒: {e}")
-                
-                # 删除临时文件
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-            
-            except Exception as e:
-                print(f"错误: 提取临时文件失败: {filename}, 错误: {e}")
-                # 如果临时文件提取失败，回退到一个一个单独处理
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                
-                # 回退方案：单独处理每个切片
-                for duration in missing_durations:
-                    output_filename = f"{name}_0-{duration}s{ext}"
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    fallback_cmd = [
-                        'ffmpeg', '-y',
-                        '-i', video_path,
-                        '-ss', '0',
-                        '-t', str(duration),
-                        '-c:v', 'libx264',
-                        '-crf', str(CONFIG['crf_value']),
-                        '-preset', CONFIG['ffmpeg_preset'],
-                        '-c:a', 'aac',
-                        '-threads', str(CONFIG['ffmpeg_threads']),
-                        output_path
-                    ]
-                    
-                    try:
-                        result = subprocess.run(fallback_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=CONFIG['timeout'])
-                        output_files.append(output_path)
-                        success_count += 1
-                    except Exception as e2:
-                        print(f"错误: 回退方案也失败: {filename} 的 0-{duration}秒: {e2}")
+        # 所有切片都从0秒（关键帧）开始，流复制即可得到切片，无需解码和重新编码
+        try:
+            copy_args = ['-c', 'copy']
+            ffmpeg_cmd = build_multi_output_cmd(video_path, outputs, copy_args)
+            output_files.extend(run_multi_output_cmd(ffmpeg_cmd, outputs, config['timeout']))
+            success_count += len(outputs)
+        except Exception as e:
+            log.warning(f"错误: {file_type}切片失败: {filename} 的 {missing_durations} 秒: {e}")
+            # 视频流复制失败时回退到重新编码
+            if not is_audio:
+                encoded = encode_video_slices(video_path, outputs, config)
+                output_files.extend(encoded)
+                success_count += len(encoded)
     
     except Exception as e:
-        print(f"错误: 处理文件时出现异常: {filename}, 错误: {e}")
+        log.error(f"错误: 处理文件时出现异常: {filename}, 错误: {e}")
     
     # 报告成功率
     if durations:
         success_rate = success_count / len(durations) * 100
         elapsed_time = time.time() - start_time
-        print(f"{file_type}切片完成: {name}, {success_count}/{len(durations)} 成功 ({success_rate:.1f}%)，耗时: {elapsed_time:.1f}秒")
+        log.debug("%s切片完成: %s, %d/%d 成功 (%.1f%%)，耗时: %.1f秒", file_type, name, success_count, len(durations), success_rate, elapsed_time)
     
     return output_files
 
-def process_video_worker(file_path):
+def process_video_worker(file_path, config=None):
     """处理单个视频或音频的工作函数，用于并行处理"""
     try:
-        return slice_video(file_path), None
+        return slice_video(file_path, config=config), None
     except Exception as e:
         return None, (file_path, str(e))
 
-def process_files_batch(file_paths, max_workers=None):
-    """批量处理文件"""
+def process_files_batch(file_paths, max_workers=None, config=None):
+    """批量处理文件（多进程，配置显式传给子进程，不依赖子进程中的全局变量）"""
+    if config is None:
+        config = CONFIG
+    
     if max_workers is None:
-        max_workers = CONFIG['max_workers']
+        max_workers = config['max_workers']
     
     errors = []
     results = []
     
     with tqdm(total=len(file_paths), desc="批量处理进度") as pbar:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_path = {executor.submit(process_video_worker, path): path for path in file_paths}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            future_to_path = {executor.submit(process_video_worker, path, config): path for path in file_paths}
             for future in concurrent.futures.as_completed(future_to_path):
                 path = future_to_path[future]
                 try:
@@ -262,18 +252,18 @@ def process_files_batch(file_paths, max_workers=None):
                     else:
                         results.extend(result or [])
                 except Exception as exc:
-                    print(f'{path} 生成的错误: {exc}')
+                    log.warning(f'{path} 生成的错误: {exc}')
                     errors.append((path, str(exc)))
                 finally:
                     pbar.update(1)
     
     # 报告错误
     if errors:
-        print(f"处理过程中遇到 {len(errors)} 个错误:")
+        log.warning(f"处理过程中遇到 {len(errors)} 个错误:")
         for path, error in errors[:5]:  # 仅显示前5个错误
-            print(f"- {path}: {error}")
+            log.warning(f"- {path}: {error}")
         if len(errors) > 5:
-            print(f"... 以及其他 {len(errors) - 5} 个错误")
+            log.warning(f"... 以及其他 {len(errors) - 5} 个错误")
     
     return results
 
@@ -297,7 +287,7 @@ def process_all_videos(base_dir='/Volumes/externalssd/video_data', video_pattern
         for audio_file in glob.glob(os.path.join(root, audio_pattern)):
             audio_files.append(audio_file)
     
-    print(f"找到 {len(video_files)} 个视频文件和 {len(audio_files)} 个音频文件")
+    log.info(f"找到 {len(video_files)} 个视频文件和 {len(audio_files)} 个音频文件")
     
     # 分批处理视频文件
     batch_size = CONFIG['batch_size']
@@ -305,13 +295,13 @@ def process_all_videos(base_dir='/Volumes/externalssd/video_data', video_pattern
     total_audio_slices = []
     
     for i in range(0, len(video_files), batch_size):
-        print(f"处理视频批次 {i//batch_size + 1}/{(len(video_files) + batch_size - 1)//batch_size}")
+        log.info(f"处理视频批次 {i//batch_size + 1}/{(len(video_files) + batch_size - 1)//batch_size}")
         batch = video_files[i:i+batch_size]
         slices = process_files_batch(batch, max_workers)
         total_video_slices.extend(slices)
     
     for i in range(0, len(audio_files), batch_size):
-        print(f"处理音频批次 {i//batch_size + 1}/{(len(audio_files) + batch_size - 1)//batch_size}")
+        log.info(f"处理音频批次 {i//batch_size + 1}/{(len(audio_files) + batch_size - 1)//batch_size}")
         batch = audio_files[i:i+batch_size]
         slices = process_files_batch(batch, max_workers)
         total_audio_slices.extend(slices)
@@ -320,8 +310,8 @@ def process_all_videos(base_dir='/Volumes/externalssd/video_data', video_pattern
     hours, remainder = divmod(elapsed_time, 3600)
     minutes, seconds = divmod(remainder, 60)
     
-    print(f"处理完成! 总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
-    print(f"生成了 {len(total_video_slices)} 个视频切片和 {len(total_audio_slices)} 个音频切片")
+    log.info(f"处理完成! 总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
+    log.info(f"生成了 {len(total_video_slices)} 个视频切片和 {len(total_audio_slices)} 个音频切片")
     
     return total_video_slices, total_audio_slices
 
@@ -336,35 +326,24 @@ def process_from_csv(csv_file='portrait_videos.csv', video_dir='/Volumes/externa
     try:
         df = pd.read_csv(csv_file)
         bvids = df['bvid'].tolist()
-        print(f"从CSV文件中读取了 {len(bvids)} 个BV号")
+        log.info(f"从CSV文件中读取了 {len(bvids)} 个BV号")
     except Exception as e:
-        print(f"读取CSV文件失败: {e}")
+        log.error(f"读取CSV文件失败: {e}")
         return [], []
     
     # 查找所有视频和音频文件
     video_files = []
     audio_files = []
     
-    with tqdm(total=len(bvids), desc="查找文件") as pbar:
-        for bvid in bvids:
-            bvid_dir = os.path.join(video_dir, bvid)
-            if not os.path.exists(bvid_dir):
-                pbar.update(1)
-                continue
-            
-            # 查找视频文件
-            video_file = find_video_in_dir(bvid_dir)
-            if video_file:
-                video_files.append(video_file)
-            
-            # 查找音频文件
-            audio_file = find_audio_in_dir(bvid_dir)
-            if audio_file:
-                audio_files.append(audio_file)
-            
-            pbar.update(1)
-    
-    print(f"找到 {len(video_files)} 个视频文件和 {len(audio_files)} 个音频文件")
+    index = index_video_dir(video_dir, wanted=set(bvids))
+    for bvid in bvids:
+        video_file, audio_file = index.get(bvid, (None, None))
+        if video_file:
+            video_files.append(video_file)
+        if audio_file:
+            audio_files.append(audio_file)
+    
+    log.info(f"找到 {len(video_files)} 个视频文件和 {len(audio_files)} 个音频文件")
     
     # 分批处理文件
     batch_size = CONFIG['batch_size']
@@ -372,13 +351,13 @@ def process_from_csv(csv_file='portrait_videos.csv', video_dir='/Volumes/externa
     total_audio_slices = []
     
     for i in range(0, len(video_files), batch_size):
-        print(f"处理视频批次 {i//batch_size + 1}/{(len(video_files) + batch_size - 1)//batch_size}")
+        log.info(f"处理视频批次 {i//batch_size + 1}/{(len(video_files) + batch_size - 1)//batch_size}")
         batch = video_files[i:i+batch_size]
         slices = process_files_batch(batch, max_workers)
         total_video_slices.extend(slices)
     
     for i in range(0, len(audio_files), batch_size):
-        print(f"处理音频批次 {i//batch_size + 1}/{(len(audio_files) + batch_size - 1)//batch_size}")
+        log.info(f"处理音频批次 {i//batch_size + 1}/{(len(audio_files) + batch_size - 1)//batch_size}")
         batch = audio_files[i:i+batch_size]
         slices = process_files_batch(batch, max_workers)
         total_audio_slices.extend(slices)
@@ -387,8 +366,8 @@ def process_from_csv(csv_file='portrait_videos.csv', video_dir='/Volumes/externa
     hours, remainder = divmod(elapsed_time, 3600)
     minutes, seconds = divmod(remainder, 60)
     
-    print(f"处理完成! 总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
-    print(f"生成了 {len(total_video_slices)} 个视频切片和 {len(total_audio_slices)} 个音频切片")
+    log.info(f"处理完成! 总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
+    log.info(f"生成了 {len(total_video_slices)} 个视频切片和 {len(total_audio_slices)} 个音频切片")
     
     return total_video_slices, total_audio_slices
 
@@ -401,11 +380,11 @@ def process_from_parquet(parquet_file='step_1_df.parquet', video_dir='/Volumes/e
     
     # 读取Parquet文件
     try:
-        df = pd.read_parquet(parquet_file)
-        bvids = df['bvid'].unique().tolist()
-        print(f"从Parquet文件中读取了 {len(bvids)} 个唯一BV号")
+        # 只读取 bvid 一列
+        bvids = pq.read_table(parquet_file, columns=['bvid']).column('bvid').unique().to_pylist()
+        log.info(f"从Parquet文件中读取了 {len(bvids)} 个唯一BV号")
     except Exception as e:
-        print(f"读取Parquet文件失败: {e}")
+        log.error(f"读取Parquet文件失败: {e}")
         return [], []
     
     # 查找所有视频和音频文件
@@ -413,28 +392,17 @@ def process_from_parquet(parquet_file='step_1_df.parquet', video_dir='/Volumes/e
     audio_files = []
     found_bvids = set()
     
-    with tqdm(total=len(bvids), desc="查找文件") as pbar:
-        for bvid in bvids:
-            bvid_dir = os.path.join(video_dir, bvid)
-            if not os.path.exists(bvid_dir):
-                pbar.update(1)
-                continue
-            
-            # 查找视频文件
-            video_file = find_video_in_dir(bvid_dir)
-            if video_file:
-                video_files.append(video_file)
-                found_bvids.add(bvid)
-            
-            # 查找音频文件
-            audio_file = find_audio_in_dir(bvid_dir)
-            if audio_file:
-                audio_files.append(audio_file)
-            
-            pbar.update(1)
-    
-    print(f"在视频目录中找到 {len(found_bvids)}/{len(bvids)} 个BV号的视频")
-    print(f"找到 {len(video_files)} 个视频文件和 {len(audio_files)} 个音频文件")
+    index = index_video_dir(video_dir, wanted=set(bvids))
+    for bvid in bvids:
+        video_file, audio_file = index.get(bvid, (None, None))
+        if video_file:
+            video_files.append(video_file)
+            found_bvids.add(bvid)
+        if audio_file:
+            audio_files.append(audio_file)
+    
+    log.info(f"在视频目录中找到 {len(found_bvids)}/{len(bvids)} 个BV号的视频")
+    log.info(f"找到 {len(video_files)} 个视频文件和 {len(audio_files)} 个音频文件")
     
     # 分批处理文件
     batch_size = CONFIG['batch_size']
@@ -442,13 +410,13 @@ def process_from_parquet(parquet_file='step_1_df.parquet', video_dir='/Volumes/e
     total_audio_slices = []
     
     for i in range(0, len(video_files), batch_size):
-        print(f"处理视频批次 {i//batch_size + 1}/{(len(video_files) + batch_size - 1)//batch_size}")
+        log.info(f"处理视频批次 {i//batch_size + 1}/{(len(video_files) + batch_size - 1)//batch_size}")
         batch = video_files[i:i+batch_size]
         slices = process_files_batch(batch, max_workers)
         total_video_slices.extend(slices)
     
     for i in range(0, len(audio_files), batch_size):
-        print(f"处理音频批次 {i//batch_size + 1}/{(len(audio_files) + batch_size - 1)//batch_size}")
+        log.info(f"处理音频批次 {i//batch_size + 1}/{(len(audio_files) + batch_size - 1)//batch_size}")
         batch = audio_files[i:i+batch_size]
         slices = process_files_batch(batch, max_workers)
         total_audio_slices.extend(slices)
@@ -457,8 +425,8 @@ def process_from_parquet(parquet_file='step_1_df.parquet', video_dir='/Volumes/e
     hours, remainder = divmod(elapsed_time, 3600)
     minutes, seconds = divmod(remainder, 60)
     
-    print(f"处理完成! 总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
-    print(f"生成了 {len(total_video_slices)} 个视频切片和 {len(total_audio_slices)} 个音频切片")
+    log.info(f"处理完成! 总耗时: {int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒")
+    log.info(f"生成了 {len(total_video_slices)} 个视频切片和 {len(total_audio_slices)} 个音频切片")
     
     return total_video_slices, total_audio_slices
 
@@ -489,12 +457,12 @@ def clean_all_slices(base_dir='/Volumes/externalssd/video_data', dry_run=False):
                         files_to_delete.append((file_path, file_size))
                         pbar.update(1)
                     except Exception as e:
-                        print(f"获取文件信息失败: {file_path}, 错误: {e}")
+                        log.warning(f"获取文件信息失败: {file_path}, 错误: {e}")
     
-    print(f"找到 {total_files} 个切片文件，总大小: {total_size:.2f} MB")
+    log.info(f"找到 {total_files} 个切片文件，总大小: {total_size:.2f} MB")
     
     if dry_run:
-        print("仅测试运行，未删除任何文件")
+        log.info("仅测试运行，未删除任何文件")
         return
     
     # 删除文件
@@ -508,13 +476,13 @@ def clean_all_slices(base_dir='/Volumes/externalssd/video_data', dry_run=False):
                 deleted_files += 1
                 deleted_size += file_size
             except Exception as e:
-                print(f"删除文件失败: {file_path}, 错误: {e}")
+                log.warning(f"删除文件失败: {file_path}, 错误: {e}")
             finally:
                 pbar.update(1)
     
     elapsed_time = time.time() - start_time
-    print(f"已删除 {deleted_files}/{total_files} 个切片文件，释放 {deleted_size:.2f} MB 空间")
-    print(f"清理耗时: {elapsed_time:.2f} 秒")
+    log.info(f"已删除 {deleted_files}/{total_files} 个切片文件，释放 {deleted_size:.2f} MB 空间")
+    log.info(f"清理耗时: {elapsed_time:.2f} 秒")
 
 def clean_previous_slices(base_dir='/Volumes/externalssd/video_data'):
     """删除先前生成的切片文件，包括临时文件"""
@@ -526,31 +494,78 @@ def clean_previous_slices(base_dir='/Volumes/externalssd/video_data'):
             for file_path in glob.glob(os.path.join(root, pattern)):
                 try:
                     os.remove(file_path)
-                    print(f"已删除临时文件: {file_path}")
+                    log.debug("已删除临时文件: %s", file_path)
                 except Exception as e:
-                    print(f"删除文件失败: {file_path}, 错误: {e}")
+                    log.warning(f"删除文件失败: {file_path}, 错误: {e}")
 
-def find_video_in_dir(bvid_dir):
-    """查找目录中的视频文件，优先查找合并后的MP4文件，其次是视频轨道文件"""
-    # 查找合并后的MP4文件
-    mp4_files = [f for f in os.listdir(bvid_dir) if f.endswith('.mp4') and not (f.endswith('_video.mp4') or f.endswith('_audio.mp4'))]
-    if mp4_files:
-        return os.path.join(bvid_dir, mp4_files[0])
+def scan_bvid_dir(bvid_dir):
+    """
+    一次扫描BV号目录，同时查找视频和音频文件
+    视频优先使用合并后的MP4文件，其次是视频轨道文件
+    
+    Returns:
+        tuple: (视频路径, 音频路径)，不存在的为None
+    """
+    bvid = os.path.basename(bvid_dir)
+    video_name = f"{bvid}{VIDEO_SUFFIX}"
+    audio_name = f"{bvid}{AUDIO_SUFFIX}"
+    merged_file = video_file = audio_file = None
+    try:
+        with os.scandir(bvid_dir) as it:
+            for entry in it:
+                name = entry.name
+                if name == video_name:
+                    video_file = entry.path
+                elif name == audio_name:
+                    audio_file = entry.path
+                elif merged_file is None and name.endswith('.mp4') and not name.endswith(TRACK_SUFFIXES):
+                    merged_file = entry.path
+    except (FileNotFoundError, NotADirectoryError):
+        return None, None
+    return merged_file or video_file, audio_file
+
+def index_video_dir(root, wanted=None, max_workers=None):
+    """
+    一次遍历视频目录，建立 {BV号: (视频路径, 音频路径)} 索引，
+    之后按BV号查字典即可，无需对每个BV号分别检查目录
     
-    # 查找视频轨道文件
-    video_file = os.path.join(bvid_dir, f"{os.path.basename(bvid_dir)}_video.mp4")
-    if os.path.exists(video_file):
-        return video_file
+    Args:
+        root (str): 视频目录路径
+        wanted (set): 只扫描这些BV号的子目录，默认为None（扫描全部子目录）
+        max_workers (int): 并行扫描子目录的线程数，默认为 CONFIG['discovery_workers']
     
-    return None
+    Returns:
+        dict: {BV号: (视频路径, 音频路径)}
+    """
+    if max_workers is None:
+        max_workers = CONFIG['discovery_workers']
+    
+    try:
+        with os.scandir(root) as it:
+            # 先按目录名过滤，不需要的子目录不会被扫描
+            bvid_dirs = [
+                entry.path for entry in it
+                if (wanted is None or entry.name in wanted) and entry.is_dir()
+            ]
+    except FileNotFoundError:
+        log.warning(f"视频目录不存在: {root}")
+        return {}
+    
+    # 每个子目录只需一次 scandir，属于 I/O 密集型任务，使用线程池并行
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        scans = executor.map(scan_bvid_dir, bvid_dirs)
+        return {
+            os.path.basename(bvid_dir): scan
+            for bvid_dir, scan in tqdm(zip(bvid_dirs, scans), total=len(bvid_dirs), desc="索引视频目录")
+        }
+
+def find_video_in_dir(bvid_dir):
+    """查找目录中的视频文件，优先查找合并后的MP4文件，其次是视频轨道文件"""
+    return scan_bvid_dir(bvid_dir)[0]
 
 def find_audio_in_dir(bvid_dir):
     """查找目录中的音频文件"""
-    audio_file = os.path.join(bvid_dir, f"{os.path.basename(bvid_dir)}_audio.mp4")
-    if os.path.exists(audio_file):
-        return audio_file
-    
-    return None
+    return scan_bvid_dir(bvid_dir)[1]
 
 if __name__ == "__main__":
     import argparse
@@ -569,11 +584,14 @@ if __name__ == "__main__":
     
     args = parser.parse_args()
     
-    if args.mode == 'all':
-        process_all_videos(base_dir=args.video_dir, max_workers=args.workers)
-    elif args.mode == 'csv':
-        process_from_csv(csv_file=args.input, video_dir=args.video_dir, max_workers=args.workers)
-    elif args.mode == 'parquet':
-        process_from_parquet(parquet_file=args.input, video_dir=args.video_dir, max_workers=args.workers)
-    elif args.mode == 'clean':
-        clean_all_slices(base_dir=args.video_dir, dry_run=args.dry_run) 
\ No newline at end of file
+    # 逐个文件的信息为 DEBUG 级别，默认只输出批次进度和警告；日志经 tqdm.write 输出以免打断进度条
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    with logging_redirect_tqdm():
+        if args.mode == 'all':
+            process_all_videos(base_dir=args.video_dir, max_workers=args.workers)
+        elif args.mode == 'csv':
+            process_from_csv(csv_file=args.input, video_dir=args.video_dir, max_workers=args.workers)
+        elif args.mode == 'parquet':
+            process_from_parquet(parquet_file=args.input, video_dir=args.video_dir, max_workers=args.workers)
+        elif args.mode == 'clean':
+            clean_all_slices(base_dir=args.video_dir, dry_run=args.dry_run)